@@ -0,0 +1,10 @@
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+# Position searches are CPU bound, so use one (sync) worker per core
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+# Each worker can also search on a pool of processes; split the cores between the workers' pools,
+# rather than giving each worker a process per core (the app reads this when it is imported in the worker)
+os.environ.setdefault('SEARCH_PROCESSES', str(max(1, (os.cpu_count() or 1) // workers)))
+# Searches over all voicings of a chord can take a while
+timeout = 120
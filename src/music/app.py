@@ -1,25 +1,62 @@
+from __future__ import annotations
+
 import argparse
-from functools import reduce
-from operator import add
+import copy
+import hashlib
+import multiprocessing
 import os
+import tempfile
 import time
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import suppress
+from functools import lru_cache, reduce
+from operator import add, attrgetter
+from typing import Callable
 
-from flask import Flask, render_template, request, url_for, flash, redirect
-from markupsafe import escape
+from flask import Flask, flash, redirect, render_template, request, url_for
+from markupsafe import Markup
 
 from music import music
 
 STATIC_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static')
 TEMPLATE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'templates')
+# Generated audio / staff images, named by a hash of their content
+MEDIA_DIR = os.path.join(STATIC_DIR, 'cache')
+# Slash chords (e.g. C/E) can't be a single path segment, so '/' travels as '_' in URLs
+_SLASH_TO_UNDER = str.maketrans('/', '_')
+_UNDER_TO_SLASH = str.maketrans('_', '/')
 
 app = Flask(
     'music',
     static_folder=STATIC_DIR,
     template_folder=TEMPLATE_DIR,
 )
-app.config['SECRET_KEY'] = os.urandom(24).hex()
+# Must be set (and shared) in production so sessions survive restarts and work across workers
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or os.urandom(24).hex()
 SAMPLE_RATE = 11_025
 NOTE_DURATION = 2.0
+# Max number of distinct position searches to keep in memory
+CACHE_SIZE = 256
+# Max number of processes each (gunicorn) worker uses to search positions; the workers share the cores,
+# so gunicorn.conf.py divides them between the workers
+SEARCH_PROCESSES = int(os.environ.get('SEARCH_PROCESSES', os.cpu_count() or 1))
+# Audio / staff images are written in the background while positions are computed;
+# pyplot isn't thread safe, so a single worker serializes all media generation
+MEDIA_POOL = ThreadPoolExecutor(max_workers=1)
+# Max number of generated media files to keep on disk (least recently used are removed first)
+MEDIA_CACHE_SIZE = 512
+# Partially written media files older than this [s] were left by an interrupted write, and are removed
+MEDIA_TMP_MAX_AGE = 600
+# Generated media is named by content hash, so browsers never need to revalidate it
+MEDIA_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@app.after_request
+def cache_media(response):
+    if request.path.startswith(url_for('static', filename='cache/')) and response.status_code == 200:
+        response.headers['Cache-Control'] = MEDIA_CACHE_CONTROL
+    return response
 
 
 @app.route("/", methods=('GET', 'POST'))
@@ -30,8 +67,8 @@ def home():
 @app.route("/guitar_positions", methods=('GET', 'POST'))
 def guitar_positions():
     if request.method == 'POST':
-        guitar = music.Guitar(music.Guitar.parse_tuning(request.form['tuning'].strip()))
-        tuning = 'standard' if guitar.tuning_name == 'standard' else 'custom;' + request.form['tuning']
+        tuning_name = music.Guitar.tuning_name_for(request.form['tuning'].strip())
+        tuning = 'standard' if tuning_name == 'standard' else 'custom;' + request.form['tuning']
         top_n = request.form['top_n'].strip() or '-1'
         max_fret_span = request.form['max_fret_span'].strip() or str(music.DEFAULT_MAX_FRET_SPAN)
         notes_string = request.form['notes'].strip()
@@ -41,27 +78,31 @@ def guitar_positions():
         allow_thumb = request.form.get('allow_thumb', '').strip() or 'false'
         all_voicings = request.form.get('all_voicings', '').strip() or 'false'
         if notes_string:
-            return redirect(url_for(
-                'guitar_positions_display_notes',
-                notes_string=notes_string,
-                top_n='top_n=' + top_n,
-                max_fret_span='max_fret_span=' + max_fret_span,
-                tuning='tuning=' + tuning,
-                allow_thumb='allow_thumb=' + allow_thumb,
-            ))
+            try:
+                music.Note.parse_many(notes_string)
+                return redirect(url_for(
+                    'guitar_positions_display_notes',
+                    notes_string=notes_string,
+                    top_n=top_n,
+                    max_fret_span=max_fret_span,
+                    tuning=tuning,
+                    allow_thumb=allow_thumb,
+                ))
+            except ValueError as e:
+                flash(f'Invalid notes! ({e})')
         elif chord_name:
             try:
-                music.ChordName(chord_name)
+                music.ChordName.from_string(chord_name)
                 return redirect(url_for(
                     'guitar_positions_display_name',
-                    chord_name=chord_name.replace('/', '_'),
-                    top_n='top_n=' + top_n,
-                    max_fret_span='max_fret_span=' + max_fret_span,
-                    tuning='tuning=' + tuning,
-                    allow_repeats='allow_repeats=' + allow_repeats,
-                    allow_identical='allow_identical=' + allow_identical,
-                    allow_thumb='allow_thumb=' + allow_thumb,
-                    all_voicings='all_voicings=' + all_voicings,
+                    chord_name=chord_name.translate(_SLASH_TO_UNDER),
+                    top_n=top_n,
+                    max_fret_span=max_fret_span,
+                    tuning=tuning,
+                    allow_repeats=allow_repeats,
+                    allow_identical=allow_identical,
+                    allow_thumb=allow_thumb,
+                    all_voicings=all_voicings,
                 ))
             except ValueError as e:
                 flash(f'Invalid chord name! ({e})')
@@ -70,102 +111,59 @@ def guitar_positions():
     return render_template('guitar_positions_input.html')
 
 
-@app.route(
-    "/guitar_positions/notes/<notes_string>"
-    "/<top_n>/<max_fret_span>/<tuning>/<allow_thumb>"
-)
-def guitar_positions_display_notes(notes_string: str, top_n: str, max_fret_span: str, tuning: str, allow_thumb: str) -> str:
-    top_n_ = int(escape(top_n).split('=')[1])
-    if top_n_ < 0:
-        top_n_ = None
-    max_fret_span_ = int(escape(max_fret_span).split('=')[1])
-    tuning_ = escape(tuning).split('=')[1]
-    allow_thumb_: bool = escape(allow_thumb).split('=')[1] == 'true'
-    notes_list = [music.Note.from_string(note) for note in escape(notes_string).split(',')]
-    chord = music.Chord(notes_list)
-    chord.to_audio(
-        sample_rate=SAMPLE_RATE, duration=NOTE_DURATION
-    ).write_wav(
-        os.path.join(STATIC_DIR, 'temp.wav')
-    )
-    music.Staff(chords=[chord]).write_png(os.path.join(STATIC_DIR, 'temp.png'))
-    guitar = (
-        music.Guitar() if tuning_ == 'standard' else
-        music.Guitar(tuning=music.Guitar.parse_tuning(tuning_.split(';')[1]))
-    )
+@app.route("/guitar_positions/notes/<notes_string>")
+def guitar_positions_display_notes(notes_string: str) -> str:
+    top_n_ = _top_n_arg()
+    max_fret_span_ = request.args.get('max_fret_span', default=music.DEFAULT_MAX_FRET_SPAN, type=int)
+    tuning_ = request.args.get('tuning', default='standard')
+    allow_thumb_ = _flag_arg('allow_thumb')
+    chord = music.Chord(music.Note.parse_many(notes_string))
+    wav_future = MEDIA_POOL.submit(_write_wav, [chord])
+    png_future = MEDIA_POOL.submit(_write_png, [chord])
     t1 = time.time()
-    positions_playable = chord.guitar_positions(
-        guitar=guitar, max_fret_span=max_fret_span_, include_unplayable=False, allow_thumb=allow_thumb_
+    positions_playable, positions_all = _guitar_positions_for_notes(
+        notes_string, tuning_, max_fret_span_, allow_thumb_
     )
-    positions_all = chord.num_total_guitar_positions
-    positions = music.GuitarPosition.sorted(positions_playable)[:top_n_]
-    positions_printable = ['<br>'.join(p.printable()) for p in positions]
+    positions = positions_playable[:top_n_]
     elapsed_time = f'{(time.time() - t1):.2f}'
     return render_template(
         'guitar_positions_display.html',
-        chord=chord, tuning=tuning_, positions=positions_printable, chords_n=1,
-        total_n=positions_all, playable_n=len(positions_playable), elapsed_time=elapsed_time
+        wav=wav_future.result(), png=png_future.result(),
+        chord=chord, tuning=tuning_, positions=positions, positions_html=_positions_html(positions),
+        chords_n=1, total_n=positions_all, playable_n=len(positions_playable), elapsed_time=elapsed_time
     )
 
 
-@app.route(
-    "/guitar_positions/chord_name/<chord_name>"
-    "/<top_n>/<max_fret_span>/<tuning>/<allow_repeats>/<allow_identical>/<allow_thumb>/<all_voicings>"
-)
-def guitar_positions_display_name(
-        chord_name: str,
-        top_n: str,
-        max_fret_span: str,
-        tuning: str,
-        allow_repeats: str,
-        allow_identical: str,
-        allow_thumb: str,
-        all_voicings: str
-) -> str:
-    chord_name_ = escape(chord_name).replace('_', '/')
-    top_n_ = int(escape(top_n).split('=')[1])
-    if top_n_ < 0:
-        top_n_ = None
-    max_fret_span_ = int(escape(max_fret_span).split('=')[1])
-    tuning_ = escape(tuning).split('=')[1]
-    allow_repeats_: bool = escape(allow_repeats).split('=')[1] == 'true'
-    allow_identical_: bool = escape(allow_identical).split('=')[1] == 'true'
-    allow_thumb_: bool = escape(allow_thumb).split('=')[1] == 'true'
-    all_voicings_: bool = escape(all_voicings).split('=')[1] == 'true'
-    guitar = (
-        music.Guitar() if tuning_ == 'standard' else
-        music.Guitar(tuning=music.Guitar.parse_tuning(tuning_.split(';')[1]))
-    )
+@app.route("/guitar_positions/chord_name/<chord_name>")
+def guitar_positions_display_name(chord_name: str) -> str:
+    chord_name_ = chord_name.translate(_UNDER_TO_SLASH)
+    top_n_ = _top_n_arg()
+    max_fret_span_ = request.args.get('max_fret_span', default=music.DEFAULT_MAX_FRET_SPAN, type=int)
+    tuning_ = request.args.get('tuning', default='standard')
+    allow_repeats_ = _flag_arg('allow_repeats')
+    allow_identical_ = _flag_arg('allow_identical')
+    allow_thumb_ = _flag_arg('allow_thumb')
+    all_voicings_ = _flag_arg('all_voicings')
     t1 = time.time()
-    chord = music.ChordName(chord_name_)
+    chord = music.ChordName.from_string(chord_name_)
     low_chord = chord.get_chord(lower=music.Note('E', 2))
-    low_chord.to_audio(
-        sample_rate=SAMPLE_RATE, duration=NOTE_DURATION
-    ).write_wav(
-        os.path.join(STATIC_DIR, 'temp.wav')
+    wav_future = MEDIA_POOL.submit(_write_wav, [low_chord])
+    if not all_voicings_:
+        png_future = MEDIA_POOL.submit(_write_png, [low_chord])
+    positions_playable, chords_playable, positions_all = _guitar_positions_for_chord_name(
+        chord_name_, tuning_, max_fret_span_, allow_repeats_, allow_identical_, allow_thumb_
     )
-    positions_all = music.get_all_guitar_positions_for_chord_name(
-        chord_name=chord,
-        guitar=guitar,
-        max_fret_span=max_fret_span_,
-        allow_repeats=allow_repeats_,
-        allow_identical=allow_identical_,
-        allow_thumb=allow_thumb_,
-        parallel=True,
-    )
-    positions_playable = list(filter(lambda x: (x.playable and not x.redundant), positions_all))
-    if allow_repeats_:
-        positions_playable = music.GuitarPosition.filter_subsets(positions_playable)
-    chords_playable = sorted(list(set(p.chord for p in positions_playable)))
-    chords_print = chords_playable if all_voicings_ else [low_chord]
-    music.Staff(chords=chords_print).write_png(os.path.join(STATIC_DIR, 'temp.png'))
-    positions = music.GuitarPosition.sorted(positions_playable)[:top_n_]
-    positions_printable = ['<br>'.join(p.printable()) for p in positions]
+    if all_voicings_:
+        # The staff shows every playable voicing, so it has to wait for the search
+        png_future = MEDIA_POOL.submit(_write_png, list(chords_playable))
+    positions = positions_playable[:top_n_]
+    wav, png = wav_future.result(), png_future.result()
     elapsed_time = f'{(time.time() - t1):.2f}'
     return render_template(
-        'guitar_positions_display.html',
-        chord=chord_name_, tuning=tuning_, positions=positions_printable, chords_n=len(chords_playable),
-        total_n=len(positions_all), playable_n=len(positions_playable), elapsed_time=elapsed_time
+        'guitar_positions_display.html', wav=wav, png=png,
+        chord=chord_name_, tuning=tuning_, positions=positions, positions_html=_positions_html(positions),
+        chords_n=len(chords_playable),
+        total_n=positions_all, playable_n=len(positions_playable), elapsed_time=elapsed_time
     )
 
 
@@ -178,32 +176,197 @@ def voice_leading():
         return redirect(url_for(
             'voice_leading_display',
             chords_string=chords_string,
-            lower='lower=' + lower,
-            upper='upper=' + upper,
+            lower=lower,
+            upper=upper,
         ))
     return render_template('voice_leading_input.html')
 
 
-@app.route("/voice_leading/<chords_string>/<lower>/<upper>", methods=('GET', 'POST'))
-def voice_leading_display(chords_string: str, lower: str, upper: str):
+@app.route("/voice_leading/<chords_string>", methods=('GET', 'POST'))
+def voice_leading_display(chords_string: str):
     t1 = time.time()
     chord_progression = music.ChordProgression(
-        [music.ChordName(chord) for chord in escape(chords_string).split(',')]
+        [music.ChordName.from_string(chord) for chord in chords_string.split(',')]
     )
-    lower_ = music.Note.from_string(escape(lower).split('=')[1])
-    upper_ = music.Note.from_string(escape(upper).split('=')[1])
+    lower_ = music.Note.from_string(request.args.get('lower', default='G2'))
+    upper_ = music.Note.from_string(request.args.get('upper', default='G5'))
     opt_chords = chord_progression.optimal_voice_leading(lower=lower_, upper=upper_)
-    audio = reduce(add, (chord.to_audio(sample_rate=SAMPLE_RATE, duration=NOTE_DURATION) for chord in opt_chords))
-    audio.write_wav(os.path.join(STATIC_DIR, 'temp.wav'))
-    music.Staff(chords=opt_chords).write_png(os.path.join(STATIC_DIR, 'temp.png'))
+    wav_future = MEDIA_POOL.submit(_write_wav, opt_chords)
+    png_future = MEDIA_POOL.submit(_write_png, opt_chords)
+    wav, png = wav_future.result(), png_future.result()
     elapsed_time = f'{(time.time() - t1):.2f}'
     return render_template(
-        'voice_leading_display.html',
+        'voice_leading_display.html', wav=wav, png=png,
         chords=chords_string,
         elapsed_time=elapsed_time
     )
 
 
+def _positions_html(positions: Iterable[music.GuitarPosition]) -> Markup:
+    """
+    Render the positions' ASCII art in one go, rather than looping over them in the template;
+    the art includes (possibly user supplied) string names, so each line is escaped
+    """
+    return Markup('\n').join(
+        Markup('<pre>{}</pre>').format(Markup('<br>').join(position.printable())) for position in positions
+    )
+
+
+def _top_n_arg() -> int | None:
+    """The `top_n` query param, where a negative (or missing) value means all positions"""
+    top_n = request.args.get('top_n', default=-1, type=int)
+    return None if top_n < 0 else top_n
+
+
+def _flag_arg(name: str) -> bool:
+    """Boolean query params are passed as 'true' / 'false'"""
+    return request.args.get(name, default='false') == 'true'
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _guitar_positions_for_notes(
+        notes_string: str, tuning: str, max_fret_span: int, allow_thumb: bool
+) -> tuple[tuple[music.GuitarPosition, ...], int]:
+    """
+    Memoized position search for a set of notes; the results don't depend on `top_n`,
+    so the views can re-slice a cached search for any number of positions
+    :return: (sorted playable positions, total number of positions)
+    """
+    chord = music.Chord(music.Note.parse_many(notes_string))
+    positions_playable = chord.guitar_positions(
+        guitar=_guitar(tuning), max_fret_span=max_fret_span, include_unplayable=False, allow_thumb=allow_thumb
+    )
+    return tuple(music.GuitarPosition.sorted(positions_playable)), chord.num_total_guitar_positions
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _guitar_positions_for_chord_name(
+        chord_name: str,
+        tuning: str,
+        max_fret_span: int,
+        allow_repeats: bool,
+        allow_identical: bool,
+        allow_thumb: bool,
+) -> tuple[tuple[music.GuitarPosition, ...], tuple[music.Chord, ...], int]:
+    """
+    Memoized position search for all voicings of a chord name
+    :return: (sorted playable positions, sorted playable chords, total number of positions)
+    """
+    chords = _chords_for(chord_name, tuning, allow_repeats, allow_identical)
+    positions_playable = music.get_all_guitar_positions_for_chord_name(
+        chord_name=music.ChordName.from_string(chord_name),
+        guitar=_guitar(tuning),
+        max_fret_span=max_fret_span,
+        allow_repeats=allow_repeats,
+        allow_identical=allow_identical,
+        allow_thumb=allow_thumb,
+        parallel=SEARCH_PROCESSES > 1,
+        executor=_search_pool() if SEARCH_PROCESSES > 1 else None,
+        processes=SEARCH_PROCESSES,
+        chords=chords,
+        include_unplayable=False,
+    )
+    positions_all = sum(chord.num_total_guitar_positions for chord in chords)
+    if allow_repeats:
+        positions_playable = music.GuitarPosition.filter_subsets(positions_playable)
+    chords_playable = sorted({p.chord for p in positions_playable}, key=attrgetter('semitones'))
+    return tuple(music.GuitarPosition.sorted(positions_playable)), tuple(chords_playable), positions_all
+
+
+def _write_wav(chords: list[music.Chord]) -> str:
+    """Write the (arpeggiated) audio for a sequence of chords; returns the file name relative to `STATIC_DIR`"""
+    def write(path: str) -> None:
+        reduce(add, (
+            chord.to_audio(sample_rate=SAMPLE_RATE, duration=NOTE_DURATION) for chord in chords
+        )).write_wav(path)
+    return _cached_media(chords, 'wav', write)
+
+
+def _write_png(chords: list[music.Chord]) -> str:
+    """Write the staff image for a sequence of chords; returns the file name relative to `STATIC_DIR`"""
+    return _cached_media(chords, 'png', lambda path: music.Staff(chords=chords).write_png(path))
+
+
+def _cached_media(chords: list[music.Chord], ext: str, write: Callable[[str], None]) -> str:
+    """
+    Generated media only depends on the chords, so files are named by a hash of them and only written
+    if they don't already exist; this also keeps concurrent requests from clobbering each other's files
+    """
+    key = hashlib.sha1(';'.join(str(chord) for chord in chords).encode()).hexdigest()
+    filename = f'{key}.{ext}'
+    path = os.path.join(MEDIA_DIR, filename)
+    try:
+        os.utime(path)  # Mark as recently used
+    except FileNotFoundError:
+        # Not written yet (or just evicted by another worker)
+        os.makedirs(MEDIA_DIR, exist_ok=True)
+        # Unique per writer, since other threads (or workers) may be writing the same file
+        fd, tmp_path = tempfile.mkstemp(dir=MEDIA_DIR, prefix=f'.{key}.', suffix=f'.{ext}')
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+        _evict_media()
+    return f'cache/{filename}'
+
+
+def _evict_media() -> None:
+    """
+    Remove the least recently used media files beyond `MEDIA_CACHE_SIZE`,
+    and any partially written ones (named '.<key>.<random>.<ext>') older than `MEDIA_TMP_MAX_AGE`
+    """
+    entries = []
+    stale = time.time() - MEDIA_TMP_MAX_AGE
+    for entry in os.scandir(MEDIA_DIR):
+        with suppress(FileNotFoundError):  # Another worker may have already removed it
+            if not entry.name.startswith('.'):
+                entries.append((entry.stat().st_mtime, entry.path))
+            elif entry.stat().st_mtime < stale:
+                os.remove(entry.path)
+    for _, path in sorted(entries)[:-MEDIA_CACHE_SIZE]:
+        with suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def _chords_for(chord_name: str, tuning: str, allow_repeats: bool, allow_identical: bool) -> list[music.Chord]:
+    """
+    Voicings of a chord name that fit on a guitar; the position search writes its counts onto the chords,
+    so each call gets its own copies of the memoized voicings
+    """
+    return [copy.copy(chord) for chord in _voicings(chord_name, tuning, allow_repeats, allow_identical)]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _voicings(chord_name: str, tuning: str, allow_repeats: bool, allow_identical: bool) -> tuple[music.Chord, ...]:
+    """Memoized voicings of a chord name that fit on a guitar (independent of the playability options)"""
+    guitar = _guitar(tuning)
+    return tuple(music.ChordName.from_string(chord_name).get_all_chords(
+        lower=guitar.lowest, upper=guitar.highest, max_notes=len(guitar.tuning),
+        allow_repeats=allow_repeats, allow_identical=allow_identical,
+    ))
+
+
+@lru_cache(maxsize=1)
+def _search_pool() -> ProcessPoolExecutor:
+    """
+    The process pool for parallel position searches, started on first use and kept for the life of the (gunicorn)
+    worker; its processes are spawned rather than forked, since forking while `MEDIA_POOL` is busy can deadlock
+    """
+    return ProcessPoolExecutor(SEARCH_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _guitar(tuning: str) -> music.Guitar:
+    """Build a `Guitar` from the `tuning` url param (either 'standard' or 'custom;<json tuning>')"""
+    return (
+        music.Guitar() if tuning == 'standard' else
+        music.Guitar(tuning=music.Guitar.parse_tuning(tuning.split(';')[1]))
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(description='Run music helpers web app')
     parser.add_argument('--port', type=int, default=5000)
@@ -1,5 +1,9 @@
+from __future__ import annotations
+
 import argparse
 import time
+from functools import lru_cache
+from operator import attrgetter
 
 from music import music
 
@@ -7,7 +11,7 @@ from music import music
 def guitar_positions(args: argparse.Namespace):
     guitar = music.Guitar(tuning=args.tuning, capo=args.capo, frets=args.frets)
     if args.notes:
-        note_list = [music.Note.from_string(note) for note in args.notes.split(',')]
+        note_list = music.Note.parse_many(args.notes)
         chord = music.Chord(note_list)
         print(f'You input the chord: {chord}')
         positions_playable = chord.guitar_positions(
@@ -17,19 +21,22 @@ def guitar_positions(args: argparse.Namespace):
     elif args.name:
         print(f'You input the chord: {args.name}')
         chord_name = music.ChordName(args.name)
-        positions_all = music.get_all_guitar_positions_for_chord_name(
+        chords = chord_name.get_all_chords(
+            lower=guitar.lowest, upper=guitar.highest, max_notes=len(guitar.tuning),
+            allow_repeats=args.allow_repeats, allow_identical=args.allow_identical,
+        )
+        positions_playable = music.get_all_guitar_positions_for_chord_name(
             chord_name=chord_name, guitar=guitar, max_fret_span=args.max_fret_span,
             allow_repeats=args.allow_repeats, allow_identical=args.allow_identical,
-            parallel=args.parallel,
+            parallel=args.parallel, chords=chords, include_unplayable=False,
         )
-        positions_playable = list(filter(lambda x: (x.playable and not x.redundant), positions_all))
-        positions_all_count = len(positions_all)
+        positions_all_count = sum(chord.num_total_guitar_positions for chord in chords)
     else:
         raise ValueError('Either `notes` or `name` is required')
     if args.allow_repeats:
         positions_playable = music.GuitarPosition.filter_subsets(positions_playable)
-    chords_playable = sorted(list(set(p.chord for p in positions_playable)))
-    positions = music.GuitarPosition.sorted(positions_playable)[:args.top_n]
+    chords_playable = sorted({p.chord for p in positions_playable}, key=attrgetter('semitones'))
+    positions = music.GuitarPosition.sorted(positions_playable, top_n=args.top_n)
     tuning_display = guitar.tuning_name if guitar.tuning_name == 'standard' else f'{guitar.tuning_name} ({guitar}):'
     print(
         f'There are {len(chords_playable)} playable voicings and {len(positions_playable)} guitar positions '
@@ -37,13 +44,17 @@ def guitar_positions(args: argparse.Namespace):
     )
     if args.top_n:
         print(f'Here are the top {args.top_n}:')
-    for p in positions:
-        print('\n' + '\n'.join(p.printable())) if args.graphical else print(p)
+    if args.graphical:
+        rows = ('\n' + '\n'.join(p.printable()) for p in positions)
+    else:
+        rows = (str(p) for p in positions)
+    if positions:
+        print(*rows, sep='\n')
 
 
 def voice_leading(args: argparse.Namespace):
     print(f'You input the chord progresssion: {args.chords}')
-    cp = music.ChordProgression([music.ChordName(n) for n in args.chords])
+    cp = music.ChordProgression([music.ChordName.from_string(n) for n in args.chords])
     result = cp.optimal_voice_leading(
         lower=music.Note.from_string(args.lower),
         upper=music.Note.from_string(args.upper),
@@ -53,7 +64,9 @@ def voice_leading(args: argparse.Namespace):
         print(f'{chord}: {voicing}')
 
 
-def main() -> None:
+@lru_cache(maxsize=1)
+def build_parser() -> argparse.ArgumentParser:
+    """The `music-cli` argument parser (built once, so `main` can be called repeatedly in-process)"""
     parser = argparse.ArgumentParser(
         description='General purpose helpers for music',
     )
@@ -120,8 +133,11 @@ def main() -> None:
         '--upper', type=str, help='Upper bound for voicings', default='C5'
     )
     voice_leading_parser.set_defaults(func=voice_leading)
+    return parser
+
 
-    args = parser.parse_args()
+def main(argv: list[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
     t1 = time.time()
     args.func(args)
     t2 = time.time()
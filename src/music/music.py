@@ -1,26 +1,41 @@
 #! /usr/bin/python
-from functools import total_ordering, partial
-from itertools import product, combinations_with_replacement, combinations, chain, permutations
+from __future__ import annotations
+
+import heapq
 import json
-from multiprocessing import Pool
 import os
-from typing import Hashable, Optional, Any, Literal, Iterable
+import re
 import warnings
+from collections.abc import Hashable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache, total_ordering
+from itertools import (
+    chain,
+    combinations,
+    combinations_with_replacement,
+    permutations,
+    product,
+    repeat,
+)
+from operator import attrgetter
+from typing import Any, Callable, Literal
 
 try:
-    import numpy as np
     import wave
+
     import matplotlib
+    import numpy as np
     matplotlib.use('Agg')
     import matplotlib.pyplot as plt
 except ImportError:
     warnings.warn('Additional dependencies for multimedia not installed.')
 
 DEFAULT_MAX_FRET_SPAN = 4
+# Parallel position searches use at most one process per this many chords
+MIN_CHORDS_PER_PROCESS = 8
 IMAGE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static')
 
 
-@total_ordering
 class Note:
     """
     This class defines a music note by its name and octave, e.g. Note(name="G#", octave=3)
@@ -56,17 +71,30 @@ class Note:
     ALL_NOTES_NAMES: list[str] = [
         name + mod for name, mod in product(SEMITONE_MAPPER.keys(), MODIFIER_MAPPER.keys())
     ]
+    # (simple_name, modifier, semitones above C) of each note name, so a note is built with one lookup
+    NAME_LOOKUP: dict[str, tuple[str, str, int]] = {
+        name + mod: (name, mod, semitones + mod_semitones)
+        for (name, semitones), (mod, mod_semitones) in product(SEMITONE_MAPPER.items(), MODIFIER_MAPPER.items())
+    }
     STAFF_LINE_OFFSET = dict(zip(SEMITONE_MAPPER.keys(), range(len(SEMITONE_MAPPER))))
+    # Names of the 12 pitch classes (spelled with flats or sharps), indexed by semitones above C
+    FLAT_NAMES = ('C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B')
+    SHARP_NAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+    NOTE_PATTERN = re.compile(r'([A-Ga-g](?:bb|b|##|#)?)(\d)')
+    # Many thousands of notes are compared and sorted while searching chord voicings;
+    # slots make them smaller and their attributes faster to read
+    __slots__ = ('frequency', 'modifier', 'name', 'octave', 'semitones', 'simple_name', 'staff_line')
 
     def __init__(self, name: str, octave: int):
-        self.simple_name, self.modifier = self.parse_name(name)
+        try:
+            self.simple_name, self.modifier, offset = self.NAME_LOOKUP[name]
+        except KeyError:
+            # e.g. lower case names
+            self.simple_name, self.modifier = self.parse_name(name)
+            offset = self.SEMITONE_MAPPER[self.simple_name] + self.MODIFIER_MAPPER[self.modifier]
         self.name = name
         self.octave = octave
-        self.semitones = (
-            12 * self.octave +
-            self.SEMITONE_MAPPER[self.simple_name] +
-            self.MODIFIER_MAPPER[self.modifier]
-        )
+        self.semitones = 12 * self.octave + offset
         self.frequency: float = 440 * 2 ** ((self.semitones - 57) / 12)
         self.staff_line: int = (
             self.STAFF_LINE_OFFSET[self.simple_name] +
@@ -75,67 +103,75 @@ class Note:
 
     def parse_name(self, name: str) -> tuple[str, str]:
         """Init a note from a string, e.g. 'C#4'"""
-        assert len(name) <= 3
-        simple_name = name[0].upper()
-        assert simple_name in self.SEMITONE_MAPPER.keys()
-        if len(name) > 1:
-            modifier = name[1:]
-            assert modifier in self.MODIFIER_MAPPER.keys()
-        else:
-            modifier = ''
+        simple_name = name[:1].upper()
+        modifier = name[1:]
+        if simple_name not in self.SEMITONE_MAPPER or modifier not in self.MODIFIER_MAPPER:
+            raise ValueError(f'Invalid note name: {name}')
         return simple_name, modifier
 
-    def guitar_positions(self, guitar: 'Guitar' = None, valid_only: bool = True) -> 'GuitarPosition':
+    def guitar_positions(self, guitar: Guitar = None, valid_only: bool = True) -> GuitarPosition:
         """
         Return the set of all positions (string + fret) a note can be played on a guitar
         :param guitar: Guitar, defines the guitar (standard tuning by default)
         :param valid_only: bool, only include "valid" positions (above nut and below top fret)
         :return: GuitarPosition (essentially a dict of {string: fret}
         """
-        guitar = guitar or Guitar()
-        positions = {
-            string: self - note
-            for string, note in guitar.tuning.items()
-            if (valid_only and self >= note and (self - note) <= guitar.frets)
-            or not valid_only
-        }
+        guitar = guitar or Guitar.default()
+        if valid_only:
+            positions = dict(guitar.valid_frets(self))
+        else:
+            positions = {
+                string: self.semitones - open_semitones for string, open_semitones in guitar.open_semitones.items()
+            }
         return GuitarPosition(positions, guitar=guitar)
 
     @staticmethod
-    def from_semitones(semitones: int, bias: Literal['b', '#'] = 'b') -> 'Note':
-        octave = semitones // 12
-        remainder = semitones % 12
-        if remainder not in Note.SEMITONE_MAPPER.values():
-            modifier = bias
-            remainder = remainder + 1 if bias == 'b' else remainder - 1
-        else:
-            modifier = ''
-        inverse_mapper = {v: k for k, v in Note.SEMITONE_MAPPER.items()}
-        name = inverse_mapper[remainder] + modifier
-        return Note(name=name, octave=octave)
+    @lru_cache(maxsize=1024)
+    def from_semitones(semitones: int, bias: Literal['b', '#'] = 'b') -> Note:
+        """Cached, so the returned Note is shared and must not be mutated"""
+        octave, remainder = divmod(semitones, 12)
+        names = Note.FLAT_NAMES if bias == 'b' else Note.SHARP_NAMES
+        return Note(name=names[remainder], octave=octave)
 
     @staticmethod
-    def from_string(note: str) -> 'Note':
+    @lru_cache(maxsize=256)
+    def from_string(note: str) -> Note:
+        """Init a note from a string, e.g. 'C#4' (cached, so the returned Note is shared and must not be mutated)"""
         return Note(note[:-1], int(note[-1]))
 
-    def add_semitones(self, semitones: int, bias: Optional[Literal['b', '#']] = None) -> 'Note':
+    @classmethod
+    def parse_many(cls, string: str, sep: str = ',') -> list[Note]:
+        """
+        Parse a separated list of notes, e.g. 'C3,E3,G3' (whitespace around each note is ignored);
+        like `from_string`, repeated notes are shared instances
+        :raises ValueError: if any of the notes is invalid
+        """
+        notes = []
+        for token in string.split(sep):
+            match = cls.NOTE_PATTERN.fullmatch(token.strip())
+            if match is None:
+                raise ValueError(f'Invalid note: {token!r}')
+            notes.append(cls.from_string(match[0]))
+        return notes
+
+    def add_semitones(self, semitones: int, bias: Literal['b', '#'] | None = None) -> Note:
         if bias is None:
             bias = self.modifier[0] if self.modifier else 'b'
         return self.from_semitones(self.semitones + semitones, bias)
 
-    def same_name(self, other: 'Note') -> bool:
+    def same_name(self, other: Note) -> bool:
         return self.semitones % 12 == other.semitones % 12
 
-    def nearest_above(self, note: str, allow_equal: bool = True) -> 'Note':
+    def nearest_above(self, note: str, allow_equal: bool = True) -> Note:
         bias = note[1] if len(note) > 1 else None
-        interval = (Note(note, 0) - self) % 12
+        interval = (Note.from_string(note + '0') - self) % 12
         if not allow_equal and interval == 0:
             interval = 12
         return self.add_semitones(interval, bias)
 
-    def nearest_below(self, note: str, allow_equal: bool = True) -> 'Note':
+    def nearest_below(self, note: str, allow_equal: bool = True) -> Note:
         bias = note[1] if len(note) > 1 else None
-        interval = (self - Note(note, 0)) % 12
+        interval = (self - Note.from_string(note + '0')) % 12
         if not allow_equal and interval == 0:
             interval = 12
         return self.add_semitones(-interval, bias)
@@ -143,13 +179,23 @@ class Note:
     def __repr__(self) -> str:
         return str(self.simple_name + self.modifier + str(self.octave))
 
-    def __eq__(self, other: 'Note') -> bool:
+    def __eq__(self, other: Note) -> bool:
         return self.semitones == other.semitones
 
-    def __lt__(self, other: 'Note') -> bool:
+    # Written out rather than derived with `total_ordering`, since notes are compared in the inner search loops
+    def __lt__(self, other: Note) -> bool:
         return self.semitones < other.semitones
 
-    def __add__(self, other) -> 'Note':
+    def __le__(self, other: Note) -> bool:
+        return self.semitones <= other.semitones
+
+    def __gt__(self, other: Note) -> bool:
+        return self.semitones > other.semitones
+
+    def __ge__(self, other: Note) -> bool:
+        return self.semitones >= other.semitones
+
+    def __add__(self, other) -> Note:
         return self.add_semitones(other.semitones)
 
     def __sub__(self, other) -> int:
@@ -169,6 +215,7 @@ class Chord:
 
     Attributes:
         - notes: list[Note], sorted by semitone
+        - semitones: tuple[int, ...], the semitones of each note; a cheap key for hashing and comparing chords
         - num_total_guitar_positions: int, a mutable value that is populated after running the `guitar_positions` method
         - num_playable_guitar_positions: int, a mutable value that is populated after running the `guitar_positions` method
         - staff_line_gaps: list[int], same length as `notes`, where the first element is None,
@@ -177,6 +224,7 @@ class Chord:
 
     def __init__(self, notes: list[Note]):
         self.notes = sorted(notes)
+        self.semitones = tuple(note.semitones for note in self.notes)
         self.num_total_guitar_positions = None
         self.num_playable_guitar_positions = None
         if notes:
@@ -188,54 +236,71 @@ class Chord:
 
     def guitar_positions(
             self,
-            guitar: 'Guitar' = None,
+            guitar: Guitar = None,
             max_fret_span: int = 4,
             include_unplayable: bool = False,
-            allow_thumb: bool = True
-    ) -> list['GuitarPosition']:
+            allow_thumb: bool = True,
+            top_k: int | None = None,
+            allow_voice_crossing: bool = True
+    ) -> list[GuitarPosition]:
         """
         Return all guitar positions that can play a given `Chord`
         :param guitar: Guitar, defining the tuning
         :param max_fret_span: int, max space between lowest and highest fret to be considered "playable"
         :param include_unplayable: bool
         :param allow_thumb: bool
+        :param top_k: optional, only return this many positions (those with the smallest fret span)
+        :param allow_voice_crossing: bool, allow a lower note of the chord to be played on a higher string;
+            if False, the notes are played on strings in the guitar's string order
         :return: list[GuitarPosition]
         """
-        guitar = guitar or Guitar()
-        # This is a dict of dicts, {note: {string: fret for string in guitar} for note in chord}
-        # of all the positions each note can be played on each string
-        all_fret_positions = {
-            str(note): note.guitar_positions(guitar=guitar, valid_only=False).positions_dict
-            for note in self.notes
-        }
-        # Get just the valid positions
-        valid_strings = [
-            list(note.guitar_positions(guitar=guitar, valid_only=True).positions_dict.keys())
-            for note in self.notes
-        ]
-        valid_combinations = [comb for comb in product(*valid_strings) if len(set(comb)) == len(self.notes)]
-        self.num_total_guitar_positions = len(valid_combinations)
+        guitar = guitar or Guitar.default()
+        # This is a list of dicts, [{string: fret} for note in chord] (aligned with the notes)
+        # of the valid positions (above the nut and below the top fret) each note can be played on each string;
+        # these are kept as plain ints, and `GuitarPosition`s are only built for the combinations that are kept
+        all_fret_positions = [guitar.valid_frets(note) for note in self.notes]
+        valid_strings = [list(note_frets) for note_frets in all_fret_positions]
+        if not allow_voice_crossing:
+            # The notes are sorted, so each note goes on a later string than the one below it;
+            # this is one ordered choice of strings per combination, instead of every reordering
+            valid_combinations = [
+                comb for comb in combinations(guitar.string_names, len(self.notes))
+                if all(string in note_frets for note_frets, string in zip(all_fret_positions, comb))
+            ]
+            num_total = len(valid_combinations)
+        else:
+            # Counted separately, since pruned branches are never enumerated
+            num_total = count_distinct_combinations(valid_strings)
+            if include_unplayable:
+                valid_combinations = distinct_combinations(valid_strings)
+            else:
+                # Branches that are already too wide are cut off before building the (much more expensive)
+                # GuitarPosition
+                valid_combinations = span_limited_combinations(all_fret_positions, max_fret_span)
         playable_positions = []
         for comb in valid_combinations:
-            positions_dict = {
-                string: all_fret_positions[str(note)][string]
-                for note, string in zip(self.notes, comb)
-            }
+            positions_dict = {string: note_frets[string] for note_frets, string in zip(all_fret_positions, comb)}
             guitar_position = GuitarPosition(
                 positions_dict, notes=self.notes, guitar=guitar, max_fret_span=max_fret_span
             )
-            assert guitar_position.valid  # This should be true from above
-            if (guitar_position.playable and not guitar_position.redundant) or include_unplayable:
-                if allow_thumb or (not allow_thumb and not guitar_position.use_thumb):
-                    playable_positions.append(guitar_position)
+            if (
+                (include_unplayable or (guitar_position.playable and not guitar_position.redundant)) and
+                (allow_thumb or not guitar_position.use_thumb)
+            ):
+                playable_positions.append(guitar_position)
+        self.num_total_guitar_positions = num_total
         self.num_playable_guitar_positions = len(playable_positions)
-        return sorted(playable_positions, key=lambda x: x.fret_span)
+        if top_k is not None:
+            # Same as sorting and slicing (ties keep their order), but the rest are never sorted
+            return heapq.nsmallest(top_k, playable_positions, key=attrgetter('fret_span'))
+        playable_positions.sort(key=attrgetter('fret_span'))
+        return playable_positions
 
     @staticmethod
-    def from_string(string: str) -> 'Chord':
-        return Chord([Note.from_string(n) for n in string.split(',')])
+    def from_string(string: str) -> Chord:
+        return Chord(Note.parse_many(string))
 
-    def to_audio(self, sample_rate: int = 44_100, duration: float = 1.0, delay: bool = True) -> 'Audio':
+    def to_audio(self, sample_rate: int = 44_100, duration: float = 1.0, delay: bool = True) -> Audio:
         """
         Convert a chord to an `Audio` waveform;
         the chord is arpeggiated over the first half of the `duration`, and then rings for the second half
@@ -248,13 +313,15 @@ class Chord:
         tau = duration * 0.2
         waveform = np.zeros(n)
         delay_duration = duration / (2 * len(self.notes)) if delay else 0
+        vibrato = 0.05 * np.sin(0.5 * t)
         for i, note in enumerate(self.notes):
-            signal = np.zeros(n)
+            # sum(sin(k * w * t + phase) / 1.5 ** k for k in 1..n_harmonics) is the imaginary part of
+            # exp(1j * phase) * sum(z ** k) with z = exp(1j * w * t) / 1.5, a geometric series;
+            # so the harmonics come from a couple of complex exponentials rather than a sine per harmonic
             n_harmonics = min(10, int((sample_rate / 2) // note.frequency))
-            for harmonic in range(1, n_harmonics + 1):
-                w = 2 * np.pi * note.frequency * harmonic
-                phase = 0.05 * note.frequency * np.sin(0.5 * t)
-                signal += np.sin(w * t + phase) / 1.5 ** harmonic
+            z = np.exp(1j * 2 * np.pi * note.frequency * t) / 1.5
+            harmonics = z * (1 - z ** n_harmonics) / (1 - z)
+            signal = (np.exp(1j * note.frequency * vibrato) * harmonics).imag
             signal /= (2 * np.max(np.abs(signal)))
             delay_samples = int(sample_rate * delay_duration * i)
             envelope = np.exp(-(t - delay_duration * i) / tau)
@@ -264,7 +331,7 @@ class Chord:
         waveform /= (2 * np.max(np.abs(waveform)))
         return Audio(sample_rate=sample_rate, waveform=waveform)
 
-    def semitone_distance(self, other: 'Chord') -> int:
+    def semitone_distance(self, other: Chord) -> int:
         """
         It might not be that the case that each note resolves to its same-index counterpart in the other chord;
         so we need to check all the pairings
@@ -279,20 +346,15 @@ class Chord:
     def __repr__(self):
         return ','.join(str(n) for n in self.notes)
 
-    def __eq__(self, other: 'Chord') -> bool:
-        return (
-            (len(self.notes) == len(other.notes)) and
-            all(s == o for s, o in zip(self.notes, other.notes))
-        )
+    def __eq__(self, other: Chord) -> bool:
+        return self.semitones == other.semitones
 
     def __lt__(self, other) -> bool:
-        for s, o in zip(self.notes, other.notes):
-            if s != o:
-                return s < o
-        return len(self.notes) < len(other.notes)
+        # Note by note, and then the shorter chord first
+        return self.semitones < other.semitones
 
     def __hash__(self):
-        return hash(tuple(note.semitones for note in self.notes))
+        return hash(self.semitones)
 
 
 class ChordName:
@@ -357,24 +419,20 @@ class ChordName:
         **{k: 'b' for k in FLAT_KEYS},
         **{k: '#' for k in SHARP_KEYS},
     }
-    ALL_CHORD_NAMES = [
-        f'{note}{quality}{ext}'
-        for note, quality, ext in product(
-            KEY_BIAS.keys(), QUALITY_SEMITONE_MAPPER.keys(), EXTENSION_SEMITONE_MAPPER.keys()
-        )
-    ]
 
     def __init__(self, chord_name: str):
         self.chord_note, self.quality, self.extensions, self.root = self.parse_name(chord_name)
         self.chord_name = chord_name
         self.key_bias = self.KEY_BIAS[self.chord_note]
         self.note_names: list[str] = [
-            Note(self.chord_note, octave=0).add_semitones(s, bias=self.key_bias).name
+            Note.from_string(self.chord_note + '0').add_semitones(s, bias=self.key_bias).name
             for s in self.QUALITY_SEMITONE_MAPPER[self.quality]
         ]
         root_index = None
+        # Compared as pitch classes (ints), with the root's looked up once
+        root_pitch_class = Note.from_string(self.root + '0').semitones % 12
         for ind, note in enumerate(self.note_names):
-            if Note(note, 0).same_name(Note(self.root, 0)):
+            if Note.from_string(note + '0').semitones % 12 == root_pitch_class:
                 root_index = ind
         if root_index is not None:
             self.note_names = _rotate_list(self.note_names, root_index)
@@ -384,31 +442,52 @@ class ChordName:
         for ext in self.extensions:
             bias = ext[0] if ext[0] in ('#', 'b') else self.key_bias
             self.extension_names.append(
-                Note(self.chord_note, octave=1).add_semitones(
+                Note.from_string(self.chord_note + '1').add_semitones(
                     self.EXTENSION_SEMITONE_MAPPER[ext], bias=bias
                 ).name
             )
 
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def from_string(chord_name: str) -> ChordName:
+        """Parse a chord name (cached, so the returned ChordName is shared and must not be mutated)"""
+        return ChordName(chord_name)
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def all_chord_names() -> tuple[str, ...]:
+        """
+        Every chord name that can be parsed (built on first use rather than at import);
+        the result is cached and shared between calls
+        """
+        return tuple(
+            f'{note}{quality}{ext}'
+            for note, quality, ext in product(
+                ChordName.KEY_BIAS, ChordName.QUALITY_SEMITONE_MAPPER, ChordName.EXTENSION_SEMITONE_MAPPER
+            )
+        )
+
     def parse_name(self, name: str) -> tuple[str, str, list[str], str]:
-        chord_note = best_match(name, list(self.KEY_BIAS.keys()))
+        chord_note = best_match(name, tuple(self.KEY_BIAS))
         if '/' in name:
             remainder, root = name.split('/')
         else:
             remainder = name
             root = chord_note
         remainder = remainder.replace(chord_note, '')
-        quality = best_match(remainder, list(self.QUALITY_SEMITONE_MAPPER.keys()))
+        quality = best_match(remainder, tuple(self.QUALITY_SEMITONE_MAPPER))
         remainder = remainder.replace(quality, '')
         extensions = []
         while remainder:
-            extensions.append(best_match(remainder, list(self.EXTENSION_SEMITONE_MAPPER.keys())))
+            extensions.append(best_match(remainder, tuple(self.EXTENSION_SEMITONE_MAPPER)))
             remainder = remainder.replace(extensions[-1], '')
         assert not remainder
         return chord_note, quality, extensions, root
 
     def get_chord(
-            self, *, lower: 'Note' = Note('C', 0), raise_octave: dict[int, int] = None
-    ) -> 'Chord':
+            self, *, lower: Note = Note('C', 0), raise_octave: dict[int, int] = None,
+            note_names: list[str] | None = None, extension_names: list[str] | None = None
+    ) -> Chord:
         """
         For a chord name, return a `Chord` in close position whose root is the lowest note >= `lower`;
         alternately, `raise_octave` can raise one or more of the chord tones by one or more octaves
@@ -417,26 +496,30 @@ class ChordName:
           - raise the root (C) by one octave -> C1
           - raise the E to the nearest above -> E1
           - raise the G by two octaves above the nearest above -> G3
+        `note_names` and `extension_names` can be given in place of the chord name's own
+        (e.g. to repeat a chord tone), rather than copying or mutating the `ChordName`
         """
         raise_octave = raise_octave or {}
+        note_names = self.note_names if note_names is None else note_names
+        extension_names = self.extension_names if extension_names is None else extension_names
         notes = []
-        for note_ind, note_name in enumerate(self.note_names):
+        for note_ind, note_name in enumerate(note_names):
             semitones_to_add = raise_octave.get(note_ind, 0) * 12
             notes.append(lower.nearest_above(note_name).add_semitones(semitones_to_add))
             lower = notes[0]  # each subsequent note must be above root
         upper_chord = max(notes)  # extensions must be above chord
-        for note_ind_rel, note_name in enumerate(self.extension_names):
-            note_ind = note_ind_rel + len(self.note_names)
+        for note_ind_rel, note_name in enumerate(extension_names):
+            note_ind = note_ind_rel + len(note_names)
             semitones_to_add = raise_octave.get(note_ind, 0) * 12
             notes.append(upper_chord.nearest_above(note_name).add_semitones(semitones_to_add))
         return Chord(notes)
 
     def get_all_chords(
-            self, *, lower: 'Note' = Note('C', 0), upper: 'Note',
-            max_notes: Optional[int] = None,
+            self, *, lower: Note = Note('C', 0), upper: Note,
+            max_notes: int | None = None,
             allow_repeats: bool = False,
             allow_identical: bool = False,
-    ) -> list['Chord']:
+    ) -> list[Chord]:
         """
         For a chord name, return all `Chord`s that can fit between `lower` and `upper`;
         If `allow_repeats`, chord notes (but not extensions) can be repeated
@@ -445,35 +528,42 @@ class ChordName:
         """
         max_notes = max_notes or len(self.note_names) + len(self.extension_names)
         max_octaves = (upper - lower) // 12 + 1
-        root_notes = [lower.nearest_above(self.root).add_semitones(12 * octave) for octave in range(max_octaves)]
-        required_notes = set(Note(name, 0) for name in self.note_names[1:])
+        # The lowest instance of each note name; every other instance is a whole number of octaves above it
+        lowest = {name: lower.nearest_above(name) for name in [self.root, *self.note_names, *self.extension_names]}
+        root_notes = [lowest[self.root].add_semitones(12 * octave) for octave in range(max_octaves)]
+        required_notes = set(Note.from_string(name + '0') for name in self.note_names[1:])
+        # Candidates are checked against `upper` on semitones, so only the notes that are kept get built
         possible_notes = [
-            lower.nearest_above(note).add_semitones(12 * octave)
+            lowest[name].add_semitones(12 * octave)
             for octave in range(max_octaves)
-            for note in self.note_names
-            if lower.nearest_above(note).add_semitones(12 * octave) <= upper
+            for name in self.note_names
+            if lowest[name].semitones + 12 * octave <= upper.semitones
         ]
         possible_extensions = [
-            lower.nearest_above(ext).add_semitones(12 * octave)
+            lowest[name].add_semitones(12 * octave)
             for octave in range(1, max_octaves)
-            for ext in self.extension_names
-            if lower.nearest_above(ext).add_semitones(12 * octave) <= upper
+            for name in self.extension_names
+            if lowest[name].semitones + 12 * octave <= upper.semitones
         ]
         extensions = constrained_powerset(
             possible_extensions, max_len=len(self.extension_names), allow_repeats=False
         )
         chord_list = []
         for root_note, ext in product(root_notes, extensions):
-            upper_ = min(ext) if ext else upper
+            # Filtered on plain semitones, rather than through Note comparisons
+            root = root_note.semitones
+            top = min(ext).semitones if ext else upper.semitones
             if allow_identical:
-                note_list = filter(lambda x: root_note <= x <= upper_, possible_notes)
+                note_list = [x for x in possible_notes if root <= x.semitones <= top]
             elif allow_repeats:
-                note_list = filter(lambda x: root_note < x <= upper_, possible_notes)
+                note_list = [x for x in possible_notes if root < x.semitones <= top]
             else:
-                note_list = filter(lambda x: (root_note < x <= upper_) and not x.same_name(root_note), possible_notes)
+                note_list = [
+                    x for x in possible_notes if root < x.semitones <= top and (x.semitones - root) % 12 != 0
+                ]
             available_notes = max_notes - 1 - len(ext)  # root and extensions are already taken
             mid_notes_list = constrained_powerset(
-                list(note_list),
+                note_list,
                 required_notes=required_notes,
                 max_len=available_notes,
                 allow_repeats=allow_repeats,
@@ -483,12 +573,14 @@ class ChordName:
                 Chord([root_note, *mid_notes, *ext])
                 for mid_notes in mid_notes_list
             ]
-        return chord_list
+        # Chords hash and compare on their (sorted) semitones, so this drops any voicing that was built twice
+        # (keeping the first), rather than enumerating its guitar positions again
+        return list(dict.fromkeys(chord_list))
 
     def get_all_guitar_chords(
-            self, guitar: Optional['Guitar'] = None, allow_repeats: bool = False, allow_identical: bool = False
-    ) -> list['Chord']:
-        guitar = guitar or Guitar()
+            self, guitar: Guitar | None = None, allow_repeats: bool = False, allow_identical: bool = False
+    ) -> list[Chord]:
+        guitar = guitar or Guitar.default()
         return self.get_all_chords(
             lower=guitar.lowest, upper=guitar.highest, max_notes=len(guitar.string_names),
             allow_repeats=allow_repeats, allow_identical=allow_identical
@@ -601,7 +693,7 @@ class Audio:
             f.setframerate(self.sample_rate)
             f.writeframes(audio_norm.tobytes())
 
-    def __add__(self, other: 'Audio') -> 'Audio':
+    def __add__(self, other: Audio) -> Audio:
         assert self.sample_rate == other.sample_rate
         return Audio(
             sample_rate=self.sample_rate,
@@ -620,7 +712,7 @@ class Staff:
         - ledger_lines: list[tuple[int, int]], for each chord, the number of additional ledger lines
             above or below the grand staff that are needed
     """
-    def __init__(self, chords: Optional[list[Chord]] = None):
+    def __init__(self, chords: list[Chord] | None = None):
         # ledger line 0 is middle C, one int index for each line or space
         self.chords = chords or []
         self.ledger_lines = []
@@ -686,9 +778,11 @@ class Guitar:
         - frets: int, the number of playable frets (above the capo)
         - lowest: Note, lowest playable note
         - highest: Note, highest playable note
+        - open_semitones: dict[Hashable, int], the semitones of each string in `tuning`
+        - string_index: dict[Hashable, int], the index of each string in `string_names`
     """
 
-    STANDARD_TUNING: dict[str, 'Note'] = {
+    STANDARD_TUNING: dict[str, Note] = {
         'E': Note('E', 2),
         'A': Note('A', 2),
         'D': Note('D', 3),
@@ -698,22 +792,46 @@ class Guitar:
     }
     DEFAULT_FRETS = 22
 
-    def __init__(self, tuning: dict[Hashable, 'Note'] = None, frets: int = DEFAULT_FRETS, capo: int = 0):
+    def __init__(self, tuning: dict[Hashable, Note] = None, frets: int = DEFAULT_FRETS, capo: int = 0):
         self.open_tuning = tuning or self.STANDARD_TUNING
         self.capo = capo
         self.tuning = {name: note.add_semitones(capo) for name, note in self.open_tuning.items()}
         self.tuning_name = 'standard' if self.tuning == self.STANDARD_TUNING else 'custom'
         self.string_names = list(self.tuning.keys())
+        self.string_index = {name: i for i, name in enumerate(self.string_names)}
         self.frets = frets - capo
         self.lowest = min(note for note in self.tuning.values())
         self.highest = max(note for note in self.tuning.values()).add_semitones(self.frets)
+        self.open_semitones = {name: note.semitones for name, note in self.tuning.items()}
+        self._valid_frets: dict[int, dict[Hashable, int]] = {}
 
     def __repr__(self):
         return str(self.tuning)
 
+    def valid_frets(self, note: Note) -> dict[Hashable, int]:
+        """
+        The {string: fret} of every string `note` can be played on (above the nut and below the top fret);
+        computed once per pitch and shared between calls, so it should not be mutated
+        """
+        try:
+            return self._valid_frets[note.semitones]
+        except KeyError:
+            frets = {
+                string: note.semitones - open_semitones
+                for string, open_semitones in self.open_semitones.items()
+                if 0 <= note.semitones - open_semitones <= self.frets
+            }
+            self._valid_frets[note.semitones] = frets
+            return frets
+
     @staticmethod
-    def parse_tuning(tuning: Optional[str] = None) -> dict[str, 'Note']:
-        if not tuning:
+    @lru_cache(maxsize=128)
+    def parse_tuning(tuning: str | None = None) -> dict[str, Note]:
+        """
+        Parse a json tuning dict (e.g. '{"D": "D2", "A": "A2", ...}'); empty or 'standard' gives standard tuning.
+        Results are cached and shared between calls, so they should not be mutated
+        """
+        if not tuning or tuning == 'standard':
             return Guitar.STANDARD_TUNING
         else:
             return {
@@ -721,6 +839,20 @@ class Guitar:
                 for string, note in json.loads(tuning.replace("'", '"')).items()
             }
 
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def default() -> Guitar:
+        """
+        A standard guitar, used wherever no guitar is given;
+        the instance is cached and shared between calls, so it should not be mutated
+        """
+        return Guitar()
+
+    @staticmethod
+    def tuning_name_for(tuning: str | None = None) -> Literal['standard', 'custom']:
+        """The `tuning_name` of a Guitar with the (json) `tuning`, without having to build the Guitar"""
+        return 'standard' if Guitar.parse_tuning(tuning) == Guitar.STANDARD_TUNING else 'custom'
+
     def notes(self, position: dict[Hashable, int]) -> list[Note]:
         return [self.tuning[string].add_semitones(fret) for string, fret in position.items()]
 
@@ -758,49 +890,43 @@ class GuitarPosition:
             self,
             positions: dict[Hashable, int],
             *,
-            notes: Optional[list['Note']] = None,
-            guitar: 'Guitar' = None,
+            notes: list[Note] | None = None,
+            guitar: Guitar = None,
             max_fret_span: int = DEFAULT_MAX_FRET_SPAN
     ):
-        self.guitar = guitar or Guitar()
-        self.valid = all(0 <= fret <= self.guitar.frets for fret in positions.values())
-        if len(positions) == 0:
+        self.guitar = guitar or Guitar.default()
+        string_names = self.guitar.string_names
+        frets = list(positions.values())
+        self.valid = all(0 <= fret <= self.guitar.frets for fret in frets)
+        if len(frets) == 0:
             self.lowest_fret = None
             self.fret_span = None
         else:
-            self.lowest_fret = (
-                0 if all(f == 0 for f in positions.values())
-                else min(f for f in positions.values() if f != 0)
-            )
-            highest_fret = max(positions.values())
-            self.fret_span = highest_fret - self.lowest_fret + 1
-        # Sort the position in order of the guitar strings
-        self.positions_dict = {
-            string: positions[string]
-            for string in self.guitar.string_names
-            if string in positions
-        }
-        # Indices of open, muted, and fretted strings
-        self.open_strings = [
-            i for i, string in enumerate(self.guitar.string_names)
-            if self.positions_dict.get(string, -1) == 0
-        ]
-        self.muted_strings = [
-            i for i, string in enumerate(self.guitar.string_names)
-            if self.positions_dict.get(string, -1) == -1
-        ]
-        self.fretted_strings = [
-            i for i, string in enumerate(self.guitar.string_names)
-            if self.positions_dict.get(string, -1) > 0
-        ]
-        lowest_fret_strings = [
-            i for i, string in enumerate(self.guitar.string_names)
-            if self.positions_dict.get(string, -1) == self.lowest_fret
-        ]
+            self.lowest_fret = lowest_fret(frets)
+            self.fret_span = max(frets) - self.lowest_fret + 1
+        # Sort the position in order of the guitar strings, and find the indices of open, muted,
+        # and fretted strings, all in one pass over the strings
+        self.positions_dict = {}
+        self.open_strings = []
+        self.muted_strings = []
+        self.fretted_strings = []
+        lowest_fret_strings = []
+        for i, string in enumerate(string_names):
+            fret = positions.get(string, -1)
+            if string in positions:
+                self.positions_dict[string] = fret
+            if fret == 0:
+                self.open_strings.append(i)
+            elif fret == -1:
+                self.muted_strings.append(i)
+            elif fret > 0:
+                self.fretted_strings.append(i)
+            if fret == self.lowest_fret:
+                lowest_fret_strings.append(i)
         # Can play a 5th note with thumb on bottom string
         self.use_thumb = (
             (len(self.fretted_strings) == 5) and
-            (self.positions_dict.get(self.guitar.string_names[0], -1) == self.lowest_fret)
+            (self.positions_dict.get(string_names[0], -1) == self.lowest_fret)
         )
         self.max_interior_gap = self._max_interior_gap()
         self.playable = self.is_playable(max_fret_span=max_fret_span)
@@ -827,21 +953,23 @@ class GuitarPosition:
         # If all fretted notes are >= fret 12, this is a redundant position
         # there is an identical shape 12 frets below that gives (nearly) the same voicing
         self.redundant = all(fret >= 12 for fret in self.positions_dict.values() if fret != 0)
-        chord = self.guitar.chord(self.positions_dict)
         if notes:
-            enharmonic_chord = Chord(notes)
-            assert enharmonic_chord == chord
-            self.chord = enharmonic_chord
+            # Checked on semitones, rather than building a second `Chord` from the guitar just to compare
+            self.chord = Chord(notes)
+            assert self.chord.semitones == tuple(sorted(
+                self.guitar.open_semitones[string] + fret for string, fret in self.positions_dict.items()
+            ))
         else:
-            self.chord = chord
+            self.chord = self.guitar.chord(self.positions_dict)
 
     def _max_interior_gap(self) -> int:
         if len(self.fretted_strings) == 0:
             return 0
+        positions_get = self.positions_dict.get
         gap = 0
         max_gap = 0
-        for i in range(self.fretted_strings[0], self.fretted_strings[-1]):
-            if self.positions_dict.get(self.guitar.string_names[i], 0) == 0:
+        for string in self.guitar.string_names[self.fretted_strings[0]:self.fretted_strings[-1]]:
+            if positions_get(string, 0) == 0:
                 gap += 1
             else:
                 gap = 0
@@ -855,34 +983,35 @@ class GuitarPosition:
         if self.fret_span > max_fret_span:
             return False
         n_notes = len(self.fretted_strings)
-        n_frets = len(set(self.positions_dict.values()))
         # Can always play 4 fretted notes
         if n_notes <= 4:
             return True
         if self.use_thumb:
             return True
+        frets = list(self.positions_dict.values())
         # Otherwise, cannot be on more than 4 frets (at least some notes must be barred)
-        if n_frets > 4:
+        if len(set(frets)) > 4:
             return False
         # Cannot have more than 3 fretted notes above barred
-        if sum(fret > self.lowest_fret for fret in self.positions_dict.values()) > 3:
+        if sum(fret > self.lowest_fret for fret in frets) > 3:
             return False
-        if sum(fret == self.lowest_fret for fret in self.positions_dict.values()) == 1:
+        if frets.count(self.lowest_fret) == 1:
             return False
         else:
             return True
 
-    def __eq__(self, other: 'GuitarPosition') -> bool:
+    def __eq__(self, other: GuitarPosition) -> bool:
         return self.positions_dict == other.positions_dict
 
+    def __hash__(self):
+        return hash(frozenset(self.positions_dict.items()))
+
     def __repr__(self) -> str:
         return str(self.positions_dict)
 
-    def is_subset(self, other: 'GuitarPosition') -> bool:
-        return (
-            (self.positions_dict.keys() <= other.positions_dict.keys()) and
-            all(self_val == other.positions_dict[key] for key, self_val in self.positions_dict.items())
-        )
+    def is_subset(self, other: GuitarPosition) -> bool:
+        # Every (string, fret) pair is also in `other`, compared as set-like views of the dicts
+        return self.positions_dict.items() <= other.positions_dict.items()
 
     def printable(self) -> list[str]:
         """
@@ -911,29 +1040,44 @@ class GuitarPosition:
             rows.append(f'{left_padding}   {self.lowest_fret}fr')
         return rows
 
+    def sort_key(self, target_fret: int = 7) -> tuple[int, int, int]:
+        """Rank on fret span, then interior gaps, then near a target fret (lower is better)"""
+        return position_sort_key(target_fret)(self)
+
     @staticmethod
-    def sorted(p: list['GuitarPosition'], target_fret: int = 7) -> list['GuitarPosition']:
-        """Sort a list of GuitarPositions on fret span, then interior gaps, then near a target fret"""
-        return sorted(p, key=lambda x: (
-            # Sort first on fret span
-            x.fret_span,
-            # Then, fewest interior gaps
-            x.max_interior_gap,
-            # Then nearest to target fret
-            abs(x.lowest_fret - target_fret),
-        ))
+    def sorted(
+            p: Iterable[GuitarPosition], target_fret: int = 7, top_n: int | None = None
+    ) -> list[GuitarPosition]:
+        """
+        Sort GuitarPositions on fret span, then interior gaps, then near a target fret;
+        if `top_n` is given, only the best `top_n` are returned (without sorting all of them)
+        """
+        key = position_sort_key(target_fret)
+        if top_n is None or top_n < 0:
+            return sorted(p, key=key)[:top_n]
+        return heapq.nsmallest(top_n, p, key=key)
 
     @staticmethod
-    def filter_subsets(p: list['GuitarPosition']) -> list['GuitarPosition']:
+    def filter_subsets(p: list[GuitarPosition]) -> list[GuitarPosition]:
         """
         Drop any positions that are subsets of another position,
         e.g. given [{"E": 3, "A": 2}, {"E": 3}], drop the last element
         """
         ps = sorted(p, key=lambda x: len(x.positions_dict), reverse=True)
         out: list[GuitarPosition] = []
+        # Positions are packed into ints, a byte per string holding fret + 1 (so muted strings are 0).
+        # Every subset of the selected positions (at most 2^6 each) is kept,
+        # so that checking a position against all the selected ones is a single set lookup
+        covered: set[int] = set()
         for test_pos in ps:
-            if not any(test_pos.is_subset(selected_pos) for selected_pos in out):
+            string_index = test_pos.guitar.string_index
+            fields = [(fret + 1) << (8 * string_index[string]) for string, fret in test_pos.positions_dict.items()]
+            if sum(fields) not in covered:
                 out.append(test_pos)
+                subsets = {0}
+                for field in fields:
+                    subsets |= {sub + field for sub in subsets}
+                covered |= subsets
         return out
 
 
@@ -943,19 +1087,139 @@ def _rotate_list(list_: list[Any], n: int) -> list[Any]:
     return list_[n:] + list_[:n]
 
 
-def best_match(s: str, choices: list[str]) -> str:
-    matches = []
+def best_match(s: str, choices: Iterable[str]) -> str:
+    """The longest of `choices` that `s` starts with"""
+    choices = tuple(choices)
+    node = prefix_trie(choices)
+    match = node.get('')
+    for char in s:
+        if char not in node:
+            break
+        node = node[char]
+        match = node.get('', match)
+    if match is None:
+        raise ValueError(f'Invalid Input: {s} did not match any of {list(choices)}')
+    return match
+
+
+@lru_cache(maxsize=32)
+def prefix_trie(choices: tuple[str, ...]) -> dict[str, Any]:
+    """
+    A dict-of-dicts trie of `choices`, keyed by character;
+    the key '' in a node holds the choice that ends there
+    """
+    trie: dict[str, Any] = {}
     for choice in choices:
-        if s.startswith(choice):
-            matches.append(choice)
-    try:
-        return max(matches, key=len)
-    except ValueError:
-        raise ValueError(f'Invalid Input: {s} did not match any of {choices}')
+        node = trie
+        for char in choice:
+            node = node.setdefault(char, {})
+        node[''] = choice
+    return trie
+
+
+def position_sort_key(target_fret: int = 7) -> Callable[[GuitarPosition], tuple[int, int, int]]:
+    """
+    The key `GuitarPosition`s are ranked on (lower is better); a plain function of the position,
+    since it is called for every position that is sorted
+    """
+    def key(position: GuitarPosition) -> tuple[int, int, int]:
+        return (
+            # Sort first on fret span
+            position.fret_span,
+            # Then, fewest interior gaps
+            position.max_interior_gap,
+            # Then nearest to target fret
+            abs(position.lowest_fret - target_fret),
+        )
+
+    return key
+
+
+def lowest_fret(frets: Iterable[int]) -> int:
+    """The lowest fretted (non-zero) fret, or 0 if all strings are open"""
+    return min((f for f in frets if f != 0), default=0)
 
 
 def note_set(note_list: list[Note]) -> set[Note]:
-    return set(Note(note.name, 0) for note in note_list)
+    return set(Note.from_string(note.name + '0') for note in note_list)
+
+
+def pitch_class_mask(note_list: Iterable[Note]) -> int:
+    """
+    The `note_set` of `note_list` as a bitmask, with one bit per pitch class (semitones above C of the note name,
+    so enharmonics like C#/Db share a bit; like `note_set`, Cbb/Cb and B#/B## aren't wrapped mod 12)
+    """
+    mask = 0
+    for note in note_list:
+        mask |= 1 << (note.semitones - 12 * note.octave + 2)
+    return mask
+
+
+def distinct_combinations(choices: list[list[Hashable]]) -> Iterator[tuple[Hashable, ...]]:
+    """
+    All the ways to pick one item from each of the `choices` without picking any item twice
+    (in the same order as `itertools.product`, but branches that reuse an item are never explored)
+    """
+    comb: list[Hashable] = [None] * len(choices)
+    used: set[Hashable] = set()
+
+    def pick(i: int) -> Iterator[tuple[Hashable, ...]]:
+        if i == len(choices):
+            yield tuple(comb)
+            return
+        for item in choices[i]:
+            if item not in used:
+                used.add(item)
+                comb[i] = item
+                yield from pick(i + 1)
+                used.remove(item)
+
+    return pick(0)
+
+
+def span_limited_combinations(
+        fret_choices: list[dict[Hashable, int]], max_fret_span: int
+) -> Iterator[tuple[Hashable, ...]]:
+    """
+    `distinct_combinations` of the strings (keys) of each of `fret_choices`, keeping only those whose
+    `fret_span` is <= `max_fret_span`; since the span can only grow as notes are added,
+    a branch is dropped as soon as it is too wide
+    """
+    comb: list[Hashable] = [None] * len(fret_choices)
+    used: set[Hashable] = set()
+
+    def pick(i: int, low: int, high: int) -> Iterator[tuple[Hashable, ...]]:
+        if i == len(fret_choices):
+            yield tuple(comb)
+            return
+        for string, fret in fret_choices[i].items():
+            if string in used:
+                continue
+            # `low` is the lowest fretted (non-zero) fret so far, or 0 if all strings are open
+            new_low = min(low, fret) if low and fret else low or fret
+            new_high = max(high, fret)
+            if new_high - new_low + 1 > max_fret_span:
+                continue
+            used.add(string)
+            comb[i] = string
+            yield from pick(i + 1, new_low, new_high)
+            used.remove(string)
+
+    return pick(0, 0, 0)
+
+
+def count_distinct_combinations(choices: list[list[Hashable]]) -> int:
+    """The number of `distinct_combinations` of `choices`, counted over the sets of items used so far"""
+    bits = {item: 1 << i for i, item in enumerate(set(chain.from_iterable(choices)))}
+    counts = {0: 1}
+    for items in choices:
+        new_counts: dict[int, int] = {}
+        for used, count in counts.items():
+            for item in items:
+                if not used & bits[item]:
+                    new_counts[used | bits[item]] = new_counts.get(used | bits[item], 0) + count
+        counts = new_counts
+    return sum(counts.values())
 
 
 def constrained_powerset(
@@ -973,47 +1237,96 @@ def constrained_powerset(
     if allow_identical, it can appear multiple times (same octave)
     """
     max_len = max_len or len(note_list)
-    required_notes = required_notes or note_set(note_list)
+    required = pitch_class_mask(required_notes or note_list)
+    bits = [pitch_class_mask([note]) for note in note_list]
     func = combinations_with_replacement if allow_identical else combinations
-    powerset = chain.from_iterable(func(note_list, r) for r in range(max_len + 1))
-    if allow_repeats:
-        subset = [s for s in powerset if note_set(s) >= required_notes]
-    else:
-        subset = [s for s in powerset if note_set(s) >= required_notes and len(note_set(s)) == len(s)]
+    subset = []
+    for r in range(max_len + 1):
+        for notes, note_bits in zip(func(note_list, r), func(bits, r)):
+            mask = 0
+            for bit in note_bits:
+                mask |= bit
+            if mask & required == required and (allow_repeats or bin(mask).count('1') == r):
+                subset.append(notes)
     return subset
 
 
 def get_all_guitar_positions_for_chord_name(
-        chord_name: 'ChordName',
-        guitar: 'Guitar',
+        chord_name: ChordName,
+        guitar: Guitar,
         allow_repeats: bool,
         allow_identical: bool,
         max_fret_span: int = DEFAULT_MAX_FRET_SPAN,
         allow_thumb: bool = True,
         parallel: bool = False,
-) -> list['GuitarPosition']:
-    chords = chord_name.get_all_chords(
-        lower=guitar.lowest, upper=guitar.highest, max_notes=len(guitar.tuning),
-        allow_repeats=allow_repeats, allow_identical=allow_identical,
-    )
+        chords: Iterable[Chord] | None = None,
+        include_unplayable: bool = True,
+        allow_voice_crossing: bool = True,
+        executor: Executor | None = None,
+        processes: int | None = None,
+) -> list[GuitarPosition]:
+    """
+    Return all guitar positions for every voicing of a chord name that fits on the guitar
+    :param chords: optional precomputed voicings of `chord_name` for this guitar (e.g. memoized by the caller);
+        by default they are computed with `ChordName.get_all_chords`.
+        Either way, `num_total_guitar_positions` is populated on each of them
+    :param include_unplayable: bool, also return unplayable (and redundant) positions;
+        it is much faster to exclude them here than to filter them afterwards
+    :param allow_voice_crossing: bool, see `Chord.guitar_positions`
+    :param executor: optional process pool (e.g. kept alive by the caller) to run a `parallel` search on;
+        by default a pool is started for each search
+    :param processes: optional max number of processes for a `parallel` search (one per core by default);
+        this should match the size of `executor`, if given
+    """
+    if chords is None:
+        chords = chord_name.get_all_chords(
+            lower=guitar.lowest, upper=guitar.highest, max_notes=len(guitar.tuning),
+            allow_repeats=allow_repeats, allow_identical=allow_identical,
+        )
+    chords = list(chords)
     kwargs = {
         'guitar': guitar,
         'allow_thumb': allow_thumb,
-        'max_fret_span': max_fret_span
+        'max_fret_span': max_fret_span,
+        'include_unplayable': include_unplayable,
+        'allow_voice_crossing': allow_voice_crossing,
     }
-    if parallel:
-        with Pool(os.cpu_count()) as p:
-            nested = p.map(partial(_parallel_helper, **kwargs), chords)
-        positions = [pos for poss in nested for pos in poss]
-    else:
-        positions = []
-        for chord in chords:
-            positions += chord.guitar_positions(include_unplayable=True, **kwargs)
+    # Starting worker processes costs more than searching a handful of chords, so small searches run serially
+    processes = min(processes or os.cpu_count() or 1, len(chords) // MIN_CHORDS_PER_PROCESS)
+    if parallel and processes > 1:
+        # Chords are sent to the workers in batches, and the results are collected as they arrive
+        chunksize = max(1, len(chords) // (4 * processes))
+        if executor is not None:
+            # The pool outlives this search, so the guitar and options go with every task
+            results = executor.map(_parallel_helper, chords, repeat(kwargs), chunksize=chunksize)
+            return _collect_parallel(chords, results)
+        # The guitar and options are sent to each worker once, so the tasks only carry the chords
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(kwargs,)) as pool:
+            return _collect_parallel(chords, pool.map(_parallel_helper, chords, chunksize=chunksize))
+    # Flattened in a single pass, rather than growing the list chord by chord
+    return list(chain.from_iterable(chord.guitar_positions(**kwargs) for chord in chords))
+
+
+def _collect_parallel(
+        chords: list[Chord], results: Iterable[tuple[list[GuitarPosition], int]]
+) -> list[GuitarPosition]:
+    positions = []
+    # The counts are set on the workers' copies of the chords, so copy them back
+    for chord, (chord_positions, num_total) in zip(chords, results):
+        chord.num_total_guitar_positions = num_total
+        chord.num_playable_guitar_positions = len(chord_positions)
+        positions.extend(chord_positions)
     return positions
 
 
-def _parallel_helper(chord: 'Chord', guitar: 'Guitar', allow_thumb: bool, max_fret_span: int):
-    return chord.guitar_positions(
-        guitar=guitar, include_unplayable=True,
-        allow_thumb=allow_thumb, max_fret_span=max_fret_span
-    )
+# `Chord.guitar_positions` kwargs (including the guitar) shared by all tasks in a pool worker
+_worker_kwargs: dict[str, Any] = {}
+
+
+def _init_worker(kwargs: dict[str, Any]) -> None:
+    _worker_kwargs.update(kwargs)
+
+
+def _parallel_helper(chord: Chord, kwargs: dict[str, Any] | None = None) -> tuple[list[GuitarPosition], int]:
+    positions = chord.guitar_positions(**(_worker_kwargs if kwargs is None else kwargs))
+    return positions, chord.num_total_guitar_positions
@@ -0,0 +1,4 @@
+"""WSGI entrypoint for production servers, e.g. `gunicorn -c gunicorn.conf.py music.wsgi`"""
+from music.app import app
+
+application = app
@@ -0,0 +1,101 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from music import app, music
+
+CUSTOM_TUNING = '{"D": "D2", "A": "A2", "d": "D3", "G": "G3", "B": "B3", "e": "E4"}'
+SUMMARY_PATTERN = re.compile(
+    r'there are (\d+) unique voicings\s+and (\d+) playable guitar positions \(out of (\d+) possible\)'
+)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'MEDIA_DIR', str(tmp_path))
+    monkeypatch.setattr(app, 'SEARCH_PROCESSES', 1)
+    for cached in (app._guitar_positions_for_notes, app._guitar_positions_for_chord_name, app._voicings, app._guitar):
+        cached.cache_clear()
+    return app.app.test_client()
+
+
+def _summary(client, url: str, **query: str) -> tuple[int, int, int]:
+    """(voicings, playable positions, total positions) shown for a search"""
+    response = client.get(url, query_string=query)
+    assert response.status_code == 200
+    return tuple(int(n) for n in SUMMARY_PATTERN.search(response.data.decode()).groups())
+
+
+def _expected_for_chord_name(chord_name: str, guitar: music.Guitar, allow_repeats: bool) -> tuple[int, int, int]:
+    chords = music.ChordName(chord_name).get_all_chords(
+        lower=guitar.lowest, upper=guitar.highest, max_notes=len(guitar.tuning), allow_repeats=allow_repeats
+    )
+    positions = music.get_all_guitar_positions_for_chord_name(
+        chord_name=music.ChordName(chord_name), guitar=guitar, allow_repeats=allow_repeats, allow_identical=False,
+        chords=chords, include_unplayable=False,
+    )
+    if allow_repeats:
+        positions = music.GuitarPosition.filter_subsets(positions)
+    return (
+        len({p.chord for p in positions}),
+        len(positions),
+        sum(chord.num_total_guitar_positions for chord in chords),
+    )
+
+
+def test_chord_name_searches_are_independent(client) -> None:
+    custom = music.Guitar(tuning=music.Guitar.parse_tuning(CUSTOM_TUNING))
+    searches = [
+        ({'tuning': 'standard', 'allow_repeats': 'false'}, music.Guitar(), False),
+        ({'tuning': 'standard', 'allow_repeats': 'true'}, music.Guitar(), True),
+        ({'tuning': 'custom;' + CUSTOM_TUNING, 'allow_repeats': 'false'}, custom, False),
+        ({'tuning': 'custom;' + CUSTOM_TUNING, 'allow_repeats': 'true'}, custom, True),
+    ]
+    expected = [_expected_for_chord_name('D', guitar, allow_repeats) for _, guitar, allow_repeats in searches]
+    assert len(set(expected)) == len(expected)
+    # The second round is served from the memoized searches
+    for _ in range(2):
+        actual = [_summary(client, '/guitar_positions/chord_name/D', **query) for query, _, _ in searches]
+        assert actual == expected
+
+
+def test_notes_searches_are_independent(client) -> None:
+    notes = 'D3,A3,D4,Gb4'
+    searches = [
+        ({'tuning': 'standard'}, music.Guitar()),
+        ({'tuning': 'custom;' + CUSTOM_TUNING}, music.Guitar(tuning=music.Guitar.parse_tuning(CUSTOM_TUNING))),
+    ]
+    expected = []
+    for _, guitar in searches:
+        chord = music.Chord.from_string(notes)
+        positions = chord.guitar_positions(guitar=guitar)
+        expected.append((1, len(positions), chord.num_total_guitar_positions))
+    assert expected[0] != expected[1]
+    for _ in range(2):
+        actual = [_summary(client, f'/guitar_positions/notes/{notes}', **query) for query, _ in searches]
+        assert actual == expected
+
+
+def test_cached_media_concurrent_writes(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(app, 'MEDIA_DIR', str(tmp_path))
+    chords = [music.Chord.from_string('C3,E3,G3')]
+    num_writers = 4
+    # Every writer misses the cache before any of them has finished writing
+    barrier = threading.Barrier(num_writers)
+
+    def write(path: str) -> None:
+        barrier.wait(timeout=10)
+        with open(path, 'w') as f:
+            f.write(path)
+        time.sleep(0.01)
+
+    with ThreadPoolExecutor(num_writers) as executor:
+        futures = [executor.submit(app._cached_media, chords, 'txt', write) for _ in range(num_writers)]
+        filenames = {future.result() for future in futures}
+    assert len(filenames) == 1
+    # Only the finished file is left, and no temporary files
+    assert os.listdir(tmp_path) == [os.path.basename(filenames.pop())]
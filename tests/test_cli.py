@@ -2,6 +2,8 @@ import subprocess
 
 import pytest
 
+from music import cli
+
 
 @pytest.mark.parametrize(
     'name', ['Gmaj7', 'C#m7b11/E', 'D']
@@ -47,3 +49,10 @@ def test_voice_leading(args: list[str]) -> None:
         ['music-cli', 'voice-leading', *args],
         capture_output=True)
     assert result.returncode == 0
+
+
+def test_main_in_process(capsys: pytest.CaptureFixture) -> None:
+    for _ in range(2):
+        cli.main(['guitar-positions', '--notes', 'C3,E3,G3', '-n', '1'])
+        assert 'You input the chord: C3,E3,G3' in capsys.readouterr().out
+    assert cli.build_parser() is cli.build_parser()
@@ -1,12 +1,35 @@
+from __future__ import annotations
+
+import os
 from functools import reduce
 from operator import add
-import os
 
 import pytest
 
 from music import music
 
 
+@pytest.mark.parametrize(
+    'name,octave,simple_name,modifier,semitones',
+    [
+        ('C', 0, 'C', '', 0),
+        ('Cb', 1, 'C', 'b', 11),
+        ('B#', 3, 'B', '#', 48),
+        ('Ebb', 2, 'E', 'bb', 26),
+        ('f##', 4, 'F', '##', 55),
+    ]
+)
+def test_note_init(name: str, octave: int, simple_name: str, modifier: str, semitones: int) -> None:
+    note = music.Note(name, octave)
+    assert (note.name, note.simple_name, note.modifier, note.semitones) == (name, simple_name, modifier, semitones)
+
+
+@pytest.mark.parametrize('name', ['', 'H', 'C###', 'Cx', 'b#b'])
+def test_note_init_invalid(name: str) -> None:
+    with pytest.raises(ValueError):
+        music.Note(name, 4)
+
+
 @pytest.mark.parametrize(
     'semitones,bias,expected',
     [
@@ -44,6 +67,26 @@ def test_note_from_string(name: str, expected: music.Note) -> None:
     assert actual == expected
 
 
+@pytest.mark.parametrize(
+    'string,expected',
+    [
+        ('C0', [music.Note('C', 0)]),
+        ('C3,Eb3,G3', [music.Note('C', 3), music.Note('Eb', 3), music.Note('G', 3)]),
+        ('Ebb3, F##4', [music.Note('Ebb', 3), music.Note('F##', 4)]),
+    ]
+)
+def test_note_parse_many(string: str, expected: list[music.Note]) -> None:
+    actual = music.Note.parse_many(string)
+    assert actual == expected
+    assert [n.name for n in actual] == [n.name for n in expected]
+
+
+@pytest.mark.parametrize('string', ['', 'C', 'H3', 'C3,,E3', 'C#b3'])
+def test_note_parse_many_invalid(string: str) -> None:
+    with pytest.raises(ValueError):
+        music.Note.parse_many(string)
+
+
 @pytest.mark.parametrize(
     'semitones,expected',
     [
@@ -132,6 +175,21 @@ def test_guitar_position_gaps(position: dict, expected: int) -> None:
     assert music.GuitarPosition(position).max_interior_gap == expected
 
 
+@pytest.mark.parametrize(
+    'frets,lowest,span',
+    [
+        ([0, 0], 0, 1),
+        ([3, 0, 5], 3, 3),
+        ([7, 7], 7, 1),
+        ([1, 0, 0, 4], 1, 4),
+    ]
+)
+def test_fret_span(frets: list[int], lowest: int, span: int) -> None:
+    assert music.lowest_fret(frets) == lowest
+    position = music.GuitarPosition(dict(zip('EADGBe', frets)))
+    assert (position.lowest_fret, position.fret_span) == (lowest, span)
+
+
 def test_sort_guitar_positions() -> None:
     positions = [
         music.GuitarPosition({"E": 5, "G": 5}),
@@ -149,6 +207,47 @@ def test_sort_guitar_positions() -> None:
     assert actual == expected
 
 
+@pytest.mark.parametrize('top_n', [0, 1, 2, 3, 10])
+def test_sort_guitar_positions_top_n(top_n: int) -> None:
+    positions = [
+        music.GuitarPosition({"E": 5, "G": 5}),
+        music.GuitarPosition({"E": 1, "A": 5}),
+        music.GuitarPosition({"E": 7, "A": 7}),
+        music.GuitarPosition({"E": 7, "G": 7}),
+        music.GuitarPosition({"E": 3, "A": 2, "D": 0}),
+    ]
+    expected = music.GuitarPosition.sorted(positions)[:top_n]
+    actual = music.GuitarPosition.sorted(positions, top_n=top_n)
+    assert actual == expected
+
+
+@pytest.mark.parametrize('top_k', [0, 1, 5, 1000])
+def test_chord_guitar_positions_top_k(top_k: int) -> None:
+    chord = music.Chord.from_string('C3,E3,G3,C4')
+    expected = chord.guitar_positions(include_unplayable=True)[:top_k]
+    num_playable = chord.num_playable_guitar_positions
+    assert chord.guitar_positions(include_unplayable=True, top_k=top_k) == expected
+    assert chord.num_playable_guitar_positions == num_playable
+
+
+@pytest.mark.parametrize('include_unplayable', [True, False])
+def test_chord_guitar_positions_no_voice_crossing(include_unplayable: bool) -> None:
+    guitar = music.Guitar()
+    chord = music.Chord.from_string('C3,E3,G3,C4')
+
+    def pitches(position: music.GuitarPosition) -> list[int]:
+        # positions_dict is in string order
+        return [guitar.open_semitones[string] + fret for string, fret in position.positions_dict.items()]
+
+    positions = chord.guitar_positions(guitar, include_unplayable=include_unplayable)
+    expected = [position for position in positions if pitches(position) == sorted(pitches(position))]
+    actual = chord.guitar_positions(guitar, include_unplayable=include_unplayable, allow_voice_crossing=False)
+    assert 0 < len(actual) < len(positions)
+    assert sorted(actual, key=pitches) == sorted(expected, key=pitches)
+    if include_unplayable:
+        assert chord.num_total_guitar_positions == len(expected)
+
+
 def test_redundant_position() -> None:
     assert music.GuitarPosition({'E': 12, 'A': 13, 'b': 14}).redundant
     assert music.GuitarPosition({'E': 12, 'A': 0, 'b': 14}).redundant
@@ -278,6 +377,49 @@ def test_parse_tuning(string: str) -> None:
     assert music.Guitar.parse_tuning(string) == expected
 
 
+@pytest.mark.parametrize(
+    'note,capo,expected',
+    [
+        ('E2', 0, {'E': 0}),
+        ('A2', 0, {'E': 5, 'A': 0}),
+        ('A2', 2, {'E': 3}),
+        ('D2', 0, {}),
+        ('D7', 0, {}),
+        ('D6', 0, {'e': 22}),
+        ('E6', 0, {}),
+    ]
+)
+def test_valid_frets(note: str, capo: int, expected: dict[str, int]) -> None:
+    guitar = music.Guitar(capo=capo)
+    assert guitar.valid_frets(music.Note.from_string(note)) == expected
+    assert guitar.valid_frets(music.Note.from_string(note)) is guitar.valid_frets(music.Note.from_string(note))
+
+
+def test_default_guitar() -> None:
+    guitar = music.Guitar.default()
+    assert guitar is music.Guitar.default()
+    assert guitar.tuning == music.Guitar().tuning and guitar.frets == music.Guitar().frets
+    assert music.GuitarPosition({'E': 3, 'A': 2}).guitar is guitar
+
+
+@pytest.mark.parametrize('string', [None, '', 'standard'])
+def test_parse_tuning_standard(string: str | None) -> None:
+    assert music.Guitar.parse_tuning(string) is music.Guitar.STANDARD_TUNING
+
+
+@pytest.mark.parametrize(
+    'string,expected',
+    [
+        ('', 'standard'),
+        ('{"E": "E2", "A": "A2", "D": "D3", "G": "G3", "B": "B3", "e": "E4"}', 'standard'),
+        ('{"E": "D2", "A": "A2", "D": "D3", "G": "G3", "B": "B3", "e": "E4"}', 'custom'),
+    ]
+)
+def test_tuning_name_for(string: str, expected: str) -> None:
+    assert music.Guitar.tuning_name_for(string) == expected
+    assert music.Guitar(music.Guitar.parse_tuning(string)).tuning_name == expected
+
+
 @pytest.mark.parametrize(
     'name,expected',
     [
@@ -328,6 +470,12 @@ def test_chord_name_error() -> None:
         music.ChordName('Hb7')
 
 
+def test_chord_name_from_string() -> None:
+    chord_name = music.ChordName.from_string('Cmaj7/E')
+    assert chord_name is music.ChordName.from_string('Cmaj7/E')
+    assert chord_name.note_names == music.ChordName('Cmaj7/E').note_names
+
+
 @pytest.mark.parametrize(
     'name,expected',
     [
@@ -380,6 +528,19 @@ def test_get_chord_with_repeats() -> None:
     assert actual == expected
 
 
+def test_get_chord_with_note_names() -> None:
+    chord = music.ChordName('C')
+    actual = chord.get_chord(raise_octave={3: 1}, note_names=[*chord.note_names, 'E'])
+    expected = music.Chord([
+        music.Note('C', 0),
+        music.Note('E', 0),
+        music.Note('G', 0),
+        music.Note('E', 1),
+    ])
+    assert actual == expected
+    assert chord.note_names == ['C', 'E', 'G']
+
+
 def test_get_all_chords() -> None:
     actual = music.ChordName('C').get_all_chords(
         lower=music.Note('C', 0), upper=music.Note('E', 2)
@@ -423,6 +584,15 @@ def test_is_subset() -> None:
     b = music.GuitarPosition({'E': 3, 'A': 2, 'D': 1})
     assert a.is_subset(b)
     assert not b.is_subset(a)
+    assert not music.GuitarPosition({'E': 3, 'A': 1}).is_subset(b)
+
+
+def test_guitar_position_hash() -> None:
+    a = music.GuitarPosition({'E': 3, 'A': 2})
+    b = music.GuitarPosition({'A': 2, 'E': 3})
+    c = music.GuitarPosition({'E': 3, 'A': 2, 'D': 1})
+    assert a == b and hash(a) == hash(b)
+    assert list(dict.fromkeys([a, b, c])) == [a, c]
 
 
 def test_filter_subsets() -> None:
@@ -443,6 +613,23 @@ def test_filter_subsets() -> None:
     assert actual == expected
 
 
+def test_filter_subsets_duplicates() -> None:
+    positions = [
+        music.GuitarPosition({'E': 3, 'e': 1}),
+        music.GuitarPosition({'E': 3, 'A': 12}),
+        music.GuitarPosition({'e': 1, 'E': 3}),
+        music.GuitarPosition({'A': 12}),
+        music.GuitarPosition({'A': 0}),
+    ]
+    expected = [
+        music.GuitarPosition({'E': 3, 'e': 1}),
+        music.GuitarPosition({'E': 3, 'A': 12}),
+        music.GuitarPosition({'A': 0}),
+    ]
+    actual = music.GuitarPosition.filter_subsets(positions)
+    assert actual == expected
+
+
 def test_get_all_chords_extension() -> None:
     actual = music.ChordName('C9').get_all_chords(
         lower=music.Note('C', 0), upper=music.Note('E', 2)
@@ -546,6 +733,53 @@ def test_thumb_position_not_barre() -> None:
     assert position.printable() == expected
 
 
+@pytest.mark.parametrize(
+    'choices,expected',
+    [
+        ([], [()]),
+        ([['E', 'A']], [('E',), ('A',)]),
+        ([['E', 'A'], ['E', 'A']], [('E', 'A'), ('A', 'E')]),
+        ([['E', 'A'], ['E'], ['A', 'D']], [('A', 'E', 'D')]),
+        ([['E'], ['E']], []),
+    ]
+)
+def test_distinct_combinations(choices: list[list[str]], expected: list[tuple[str, ...]]) -> None:
+    assert list(music.distinct_combinations(choices)) == expected
+    assert music.count_distinct_combinations(choices) == len(expected)
+
+
+@pytest.mark.parametrize('max_fret_span', [1, 2, 4, 24])
+def test_span_limited_combinations(max_fret_span: int) -> None:
+    fret_choices = [
+        {'E': 0, 'A': 5, 'D': 10},
+        {'E': 3, 'A': 0, 'D': 7},
+        {'A': 2, 'D': 9, 'G': 0},
+    ]
+    expected = [
+        comb for comb in music.distinct_combinations([list(frets) for frets in fret_choices])
+        if music.GuitarPosition(
+            {string: frets[string] for frets, string in zip(fret_choices, comb)}
+        ).fret_span <= max_fret_span
+    ]
+    assert list(music.span_limited_combinations(fret_choices, max_fret_span)) == expected
+
+
+@pytest.mark.parametrize(
+    'notes,expected',
+    [
+        ('C4', 1),
+        ('C3,C4,C5', 1),
+        ('C4,E4,G4', 3),
+        ('B#3,C4', 2),
+        ('Cb4,B3', 2),
+        ('Ebb4,D4', 1),
+    ]
+)
+def test_pitch_class_mask(notes: str, expected: int) -> None:
+    note_list = music.Note.parse_many(notes)
+    assert bin(music.pitch_class_mask(note_list)).count('1') == len(music.note_set(note_list)) == expected
+
+
 def test_constrained_powerset_same_len() -> None:
     note_list = [
         music.Note('C', 0),
@@ -763,7 +997,7 @@ def test_get_all_chords_extension_again() -> None:
 
 
 def test_parse_all_chord_names() -> None:
-    for name in music.ChordName.ALL_CHORD_NAMES:
+    for name in music.ChordName.all_chord_names():
         music.ChordName(name)
 
 